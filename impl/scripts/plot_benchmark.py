@@ -1,8 +1,26 @@
 #!/usr/bin/env python3
+import argparse
+import os
+import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+from PIL import Image
+from pyarrow import csv as pacsv
 
 CSV = "../profile.csv"
+CACHE = os.path.splitext(CSV)[0] + ".feather"
+OUT = "all_plots.png"
+
+# Pre-declared column types skip pyarrow's type-inference pass
+CSV_COLUMN_TYPES = {
+    "n": "int64",
+    "ops_per_sec": "float64",
+    "alloc_calls": "int64",
+    "total_alloc_bytes": "int64",
+    "peak_bytes": "int64",
+}
 
 TESTS_SPEED = [
     "insert_build",
@@ -13,13 +31,24 @@ TESTS_SPEED = [
     "churn_delete_insert",
 ]
 
-def plot_lines(ax, sub, x, y, title, ylabel, logx=True, logy=False):
-    sub = sub.sort_values(["n", "config"])
-    for cfg in ["freelist", "no_freelist"]:
-        s = sub[sub["config"] == cfg]
-        if len(s) == 0:
+CONFIGS = ["freelist", "no_freelist"]
+
+_FIG = None
+
+MARKER_TARGET = 20
+MARKER_LIMIT = 10_000
+
+def marker_style(count):
+    if count > MARKER_LIMIT:
+        return {"marker": None}
+    return {"marker": "o", "markevery": max(1, count // MARKER_TARGET)}
+
+def plot_lines(ax, groups, test, x, y, title, ylabel, logx=True, logy=False):
+    for cfg in CONFIGS:
+        s = groups.get((test, cfg))
+        if s is None:
             continue
-        ax.plot(s[x], s[y], marker="o", linewidth=2, label=cfg)
+        ax.plot(s[x], s[y], linewidth=2, label=cfg, **marker_style(len(s)))
 
     if logx:
         ax.set_xscale("log", base=2)
@@ -29,27 +58,83 @@ def plot_lines(ax, sub, x, y, title, ylabel, logx=True, logy=False):
     ax.set_title(title)
     ax.set_xlabel("n")
     ax.set_ylabel(ylabel)
-    ax.grid(True, alpha=0.3)
+    # rasterized is kept in the tick kwargs, so ticks created at draw time get it too
+    ax.grid(True, alpha=0.3, rasterized=True)
+    ax.set_rasterization_zorder(0)
+
+def read_profile(path):
+    table = pacsv.read_csv(
+        path,
+        convert_options=pacsv.ConvertOptions(column_types=CSV_COLUMN_TYPES),
+    )
+    return table.to_pandas()
+
+def load_profile(path, cache):
+    # Reuse the Feather sidecar while it is at least as new as the CSV
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+        return pd.read_feather(cache)
+    df = read_profile(path)
+    df.to_feather(cache)
+    return df
+
+def save_png(fig, path, dpi):
+    # Pillow at zlib level 1 encodes far faster than savefig's PNG writer
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+    image = Image.fromarray(np.asarray(fig.canvas.buffer_rgba()))
+    image.save(path, format="png", dpi=(dpi, dpi), optimize=False, compress_level=1)
+
+def is_up_to_date(out, src, dpi):
+    # save_png stores the DPI in the PNG, so a different --dpi counts as stale
+    if not os.path.exists(out) or os.path.getmtime(out) <= os.path.getmtime(src):
+        return False
+    with Image.open(out) as image:
+        return round(image.info.get("dpi", (0,))[0]) == dpi
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plot OST profiling results from profile.csv")
+    parser.add_argument("--dpi", type=int, default=120, help="resolution of the saved PNG (default: 120)")
+    parser.add_argument("--force", action="store_true",
+                        help="redraw even if the PNG is newer than the CSV and has the same DPI")
+    return parser.parse_args()
 
 def main():
-    df = pd.read_csv(CSV)
+    args = parse_args()
+    if not args.force and is_up_to_date(OUT, CSV, args.dpi):
+        print(f"{OUT} is up to date (use --force to redraw)")
+        return
+
+    df = load_profile(CSV, CACHE)
 
     # Ensure the expected configs exist
     print("configs:", sorted(df["config"].unique()))
     print("tests:", sorted(df["test"].unique()))
 
-    # One big figure: 3 rows x 3 cols
-    fig, axes = plt.subplots(3, 3, figsize=(18, 12), constrained_layout=True)
+    # Categorical config groups on integer codes; other configs are not plotted
+    df["config"] = pd.Categorical(df["config"], categories=CONFIGS)
+
+    # Sort and partition once; every panel looks up its (test, config) slice
+    df = df.sort_values("n", kind="stable")
+    groups = dict(list(df.groupby(["test", "config"], observed=True, sort=False)))
+
+    # One big figure: 3 rows x 3 cols, kept across main() calls (e.g. under python -i)
+    global _FIG
+    _FIG = _FIG or plt.subplots(3, 3, figsize=(18, 12), constrained_layout=True)
+    fig, axes = _FIG
+    for ax in axes.flat:
+        ax.cla()
+    for legend in list(fig.legends):
+        legend.remove()
     fig.suptitle("OST profiling: speed + allocator behaviour (freelist vs no_freelist)", fontsize=16)
 
     # 6 speed plots
     for i, test in enumerate(TESTS_SPEED):
         r = i // 3
         c = i % 3
-        sub = df[df["test"] == test]
         plot_lines(
             axes[r, c],
-            sub,
+            groups,
+            test,
             x="n",
             y="ops_per_sec",
             title=f"{test} ops/s",
@@ -59,10 +144,10 @@ def main():
         )
 
     # churn alloc_calls (this should show freelist advantage)
-    sub_churn = df[df["test"] == "churn_delete_insert"]
     plot_lines(
         axes[2, 0],
-        sub_churn,
+        groups,
+        "churn_delete_insert",
         x="n",
         y="alloc_calls",
         title="churn: alloc_calls",
@@ -74,7 +159,8 @@ def main():
     # churn total_alloc_bytes (also shows freelist advantage)
     plot_lines(
         axes[2, 1],
-        sub_churn,
+        groups,
+        "churn_delete_insert",
         x="n",
         y="total_alloc_bytes",
         title="churn: total_alloc_bytes",
@@ -84,10 +170,10 @@ def main():
     )
 
     # insert_build peak_bytes 
-    sub_build = df[df["test"] == "insert_build"]
     plot_lines(
         axes[2, 2],
-        sub_build,
+        groups,
+        "insert_build",
         x="n",
         y="peak_bytes",
         title="insert_build: peak_bytes",
@@ -100,8 +186,8 @@ def main():
     handles, labels = axes[0, 0].get_legend_handles_labels()
     fig.legend(handles, labels, loc="upper right", frameon=True)
 
-    fig.savefig("all_plots.png", dpi=200)
-    print("Wrote all_plots.png")
+    save_png(fig, OUT, args.dpi)
+    print(f"Wrote {OUT}")
 
 if __name__ == "__main__":
     main()
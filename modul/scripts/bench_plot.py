@@ -1,6 +1,13 @@
-import csv
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+from PIL import Image
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 CSV_FILE = (SCRIPT_DIR / ".." / "bench.csv")
@@ -8,187 +15,237 @@ if not CSV_FILE.exists():
     CSV_FILE = (SCRIPT_DIR / "bench.csv")
 
 OUT_DIR = SCRIPT_DIR / "plots"
+OUT_FILE = "bench_plots.png"
+
+TIME_OPS = ["time_search_hit", "time_predecessor", "time_cycles_insert_delete"]
+
+# Per-panel file names used by --split
+SPEEDUP_FILES = {
+    "time_search_hit": "speedup_search_hit_paired.png",
+    "time_predecessor": "speedup_predecessor_paired.png",
+    "time_cycles_insert_delete": "speedup_cycles_paired.png",
+}
+MEM_FILE = "memory_insert_peak.png"
+
+_FIG = None
+
+CSV_DTYPES = {
+    "n": "int64",
+    "sample": "int32",
+    "ns_per_op": "float64",
+    "mem_peak_bytes": "float64",
+    "expected_node_bytes": "float64",
+    "op": "category",
+    "variant": "category",
+}
+
+# ~20 markers per line, plain lines past 10k points
+MARKER_TARGET = 20
+MARKER_LIMIT = 10_000
+
+def marker_style(count):
+    if count > MARKER_LIMIT:
+        return {"marker": None}
+    return {"marker": "o", "markevery": max(1, count // MARKER_TARGET)}
 
 def read_rows(path):
-    with open(path, newline="") as f:
-        return list(csv.DictReader(f))
-
-def quantile(sorted_vals, q):
-    if not sorted_vals:
-        return None
-    if len(sorted_vals) == 1:
-        return float(sorted_vals[0])
-    pos = (len(sorted_vals) - 1) * q
-    lo = int(pos)
-    hi = min(lo + 1, len(sorted_vals) - 1)
-    frac = pos - lo
-    return float(sorted_vals[lo]) * (1.0 - frac) + float(sorted_vals[hi]) * frac
-
-def group_samples(rows, op, variant, key):
-    d = {}
-    for r in rows:
-        if r["op"] != op or r["variant"] != variant:
-            continue
-        n = int(r["n"])
-        v = float(r[key])
-        d.setdefault(n, []).append(v)
-    return d
-
-def summarize(d):
-    xs = sorted(d.keys())
-    med, p25, p75 = [], [], []
-    for x in xs:
-        vals = sorted(d[x])
-        med.append(quantile(vals, 0.50))
-        p25.append(quantile(vals, 0.25))
-        p75.append(quantile(vals, 0.75))
+    # Parsed CSV is cached as a Feather sidecar and reused while it is up to date
+    cache = path.with_suffix(".feather")
+    if cache.exists() and cache.stat().st_mtime >= path.stat().st_mtime:
+        return pd.read_feather(cache)
+    df = pd.read_csv(path, dtype=CSV_DTYPES)
+    df.to_feather(cache)
+    return df
+
+NO_SAMPLES = (np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty(0))
+
+def quantile_columns(n, values):
+    # n x sample matrix, NaN-padded where an n has fewer samples, so all
+    # three quantiles come out of one nanquantile call. Returns ndarrays
+    # (xs, median, p25, p75) that go to matplotlib without conversion.
+    order = np.argsort(n, kind="stable")
+    n, values = n[order], values[order]
+    xs, start, count = np.unique(n, return_index=True, return_counts=True)
+    if xs.size == 0:
+        return NO_SAMPLES
+    m = np.full((xs.size, count.max()), np.nan)
+    m[np.repeat(np.arange(xs.size), count), np.arange(n.size) - np.repeat(start, count)] = values
+    p25, med, p75 = np.nanquantile(m, [0.25, 0.50, 0.75], axis=1)
     return xs, med, p25, p75
 
-def paired_speedup(rows, op):
-    # n -> sample -> {base/opt: ns_per_op}
-    by_n = {}
-    for r in rows:
-        if r["op"] != op:
-            continue
-        n = int(r["n"])
-        s = int(r["sample"])
-        by_n.setdefault(n, {}).setdefault(s, {})[r["variant"]] = float(r["ns_per_op"])
-
-    xs = sorted(by_n.keys())
-    meds, p25s, p75s = [], [], []
-    for n in xs:
-        ratios = []
-        for s, d in by_n[n].items():
-            if "base" in d and "opt" in d and d["opt"] != 0:
-                ratios.append(d["base"] / d["opt"])
-        ratios.sort()
-        meds.append(quantile(ratios, 0.50) if ratios else None)
-        p25s.append(quantile(ratios, 0.25) if ratios else None)
-        p75s.append(quantile(ratios, 0.75) if ratios else None)
-    return xs, meds, p25s, p75s
-
-def plot_time(rows, op, out_name):
-    base = group_samples(rows, op, "base", "ns_per_op")
-    opt  = group_samples(rows, op, "opt",  "ns_per_op")
-
-    xb, mb, b25, b75 = summarize(base)
-    xo, mo, o25, o75 = summarize(opt)
-
-    plt.figure(figsize=(6, 4))
-    if xb:
-        plt.plot(xb, mb, marker="o", label="base (median)")
-        plt.fill_between(xb, b25, b75, alpha=0.2)
-    if xo:
-        plt.plot(xo, mo, marker="o", label="opt (median)")
-        plt.fill_between(xo, o25, o75, alpha=0.2)
-
-    plt.xscale("log"); plt.yscale("log")
-    plt.xlabel("n"); plt.ylabel("ns/op")
-    plt.title(f"Laufzeit: {op}")
-    plt.grid(True, which="both", ls=":")
-    handles, labels = plt.gca().get_legend_handles_labels()
+def summarize(rows, op, variant, key):
+    sel = rows[(rows["op"] == op) & (rows["variant"] == variant)]
+    return quantile_columns(sel["n"].to_numpy(), sel[key].to_numpy())
+
+def paired_speedups(rows):
+    # Flat (op, n, sample) keys x variant -> ns_per_op, ratios for every op in one pass.
+    # A repeated key keeps its last row instead of being averaged.
+    key = ["op", "n", "sample", "variant"]
+    w = rows.drop_duplicates(key, keep="last").set_index(key)["ns_per_op"].unstack("variant")
+    if "base" not in w or "opt" not in w:
+        return {}
+    w = w[w["opt"] != 0]
+    ratio = (w["base"] / w["opt"]).dropna()
+    return {
+        op: quantile_columns(r.index.get_level_values("n").to_numpy(), r.to_numpy())
+        for op, r in ratio.groupby(level="op", observed=True)
+    }
+
+def plot_time(ax, rows, op):
+    xb, mb, b25, b75 = summarize(rows, op, "base", "ns_per_op")
+    xo, mo, o25, o75 = summarize(rows, op, "opt", "ns_per_op")
+
+    if xb.size:
+        ax.plot(xb, mb, label="base (median)", **marker_style(len(xb)))
+        ax.fill_between(xb, b25, b75, alpha=0.2)
+    if xo.size:
+        ax.plot(xo, mo, label="opt (median)", **marker_style(len(xo)))
+        ax.fill_between(xo, o25, o75, alpha=0.2)
+
+    ax.set_xscale("log"); ax.set_yscale("log")
+    ax.set_xlabel("n"); ax.set_ylabel("ns/op")
+    ax.set_title(f"Laufzeit: {op}")
+    ax.grid(True, which="both", ls=":", rasterized=True)
+    ax.set_rasterization_zorder(0)
+    handles, labels = ax.get_legend_handles_labels()
     if labels:
-        plt.legend()
-    plt.tight_layout()
-    plt.savefig(OUT_DIR / out_name, dpi=200)
-    plt.close()
-
-def plot_speedup_paired(rows, op, out_name):
-    xs, med, p25, p75 = paired_speedup(rows, op)
-    xs2, med2, p252, p752 = [], [], [], []
-    for x, m, a, b in zip(xs, med, p25, p75):
-        if m is None:
-            continue
-        xs2.append(x); med2.append(m); p252.append(a); p752.append(b)
-
-    if not xs2:
-        return
-
-    plt.figure(figsize=(6, 4))
-    plt.plot(xs2, med2, marker="o", label="paired median")
-    plt.fill_between(xs2, p252, p752, alpha=0.2)
-
-    plt.xscale("log")
-    plt.xlabel("n"); plt.ylabel("Speedup (base/opt)")
-    plt.title(f"Speedup (paired): {op}")
-    plt.grid(True, which="both", ls=":")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(OUT_DIR / out_name, dpi=200)
-    plt.close()
-
-def plot_mem_insert_peak(rows, out_name):
-    base = {}
-    opt = {}
-    exp = {}
-
-    for r in rows:
-        if r["op"] != "mem_insert_peak":
-            continue
-        n = int(r["n"])
-        peak = int(float(r["mem_peak_bytes"]))
-        expected = int(float(r["expected_node_bytes"]))
-        if r["variant"] == "base":
-            base[n] = peak
-            exp[n] = expected
-        elif r["variant"] == "opt":
-            opt[n] = peak
-
-    xs = sorted(set(base.keys()) | set(opt.keys()) | set(exp.keys()))
-    if not xs:
-        return
-
-    plt.figure(figsize=(6, 4))
-    plt.plot(xs, [base.get(x) for x in xs], marker="o", label="base peak")
-    plt.plot(xs, [opt.get(x) for x in xs], marker="o", label="opt peak")
-    plt.plot(xs, [exp.get(x) for x in xs], linestyle="--", label="expected n*sizeof(Node)")
-
-    plt.xscale("log"); plt.yscale("log")
-    plt.xlabel("n"); plt.ylabel("Bytes")
-    plt.title("Speicher: Peak bei insert (O(n) Check)")
-    plt.grid(True, which="both", ls=":")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(OUT_DIR / out_name, dpi=200)
-    plt.close()
-
-def print_speedup_table(rows, op):
-    xs, med, p25, p75 = paired_speedup(rows, op)
+        ax.legend()
+
+def plot_speedup_paired(ax, speedup, op):
+    # paired_speedups() already dropped unpaired samples; an n without pairs is absent
+    xs, med, p25, p75 = speedup
+    ax.plot(xs, med, label="paired median", **marker_style(xs.size))
+    ax.fill_between(xs, p25, p75, alpha=0.2)
+
+    ax.set_xscale("log")
+    ax.set_xlabel("n"); ax.set_ylabel("Speedup (base/opt)")
+    ax.set_title(f"Speedup (paired): {op}")
+    ax.grid(True, which="both", ls=":", rasterized=True)
+    ax.set_rasterization_zorder(0)
+    ax.legend()
+
+def plot_mem_insert_peak(ax, rows):
+    sel = rows[rows["op"] == "mem_insert_peak"]
+    # n -> last row per variant, same as overwriting a dict keyed by n
+    base = sel[sel["variant"] == "base"].drop_duplicates("n", keep="last").set_index("n")
+    opt = sel[sel["variant"] == "opt"].drop_duplicates("n", keep="last").set_index("n")
+
+    xs = base.index.union(opt.index)
+    ax.plot(xs, base["mem_peak_bytes"].reindex(xs), label="base peak", **marker_style(len(xs)))
+    ax.plot(xs, opt["mem_peak_bytes"].reindex(xs), label="opt peak", **marker_style(len(xs)))
+    ax.plot(xs, base["expected_node_bytes"].reindex(xs), linestyle="--", label="expected n*sizeof(Node)")
+
+    ax.set_xscale("log"); ax.set_yscale("log")
+    ax.set_xlabel("n"); ax.set_ylabel("Bytes")
+    ax.set_title("Speicher: Peak bei insert (O(n) Check)")
+    ax.grid(True, which="both", ls=":", rasterized=True)
+    ax.set_rasterization_zorder(0)
+    ax.legend()
+
+def print_speedup_table(speedup, op):
+    xs, med, p25, p75 = speedup
     print(f"\n== speedup paired: {op} ==")
     print("n\tmedian\tp25\tp75")
     for n, m, a, b in zip(xs, med, p25, p75):
-        if m is None:
-            continue
         print(f"{n}\t{m:.4f}\t{a:.4f}\t{b:.4f}")
 
+def save_png(fig, path, dpi):
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+    image = Image.fromarray(np.asarray(fig.canvas.buffer_rgba()))
+    image.save(path, format="png", dpi=(dpi, dpi), optimize=False, compress_level=1)
+
+def render_panel(out_path, plot, plot_args, dpi):
+    # Runs in a worker process; every panel gets its own Agg figure
+    fig, ax = plt.subplots(figsize=(6, 4), constrained_layout=True)
+    plot(ax, *plot_args)
+    save_png(fig, out_path, dpi)
+    plt.close(fig)
+
+def is_up_to_date(out, src, dpi):
+    # DPI is read back from the PNG header, a different --dpi means redraw
+    if not out.exists() or out.stat().st_mtime <= src.stat().st_mtime:
+        return False
+    with Image.open(out) as image:
+        return round(image.info.get("dpi", (0,))[0]) == dpi
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plot benchmark results from bench.csv")
+    parser.add_argument("--dpi", type=int, default=120, help="resolution of the saved PNG (default: 120)")
+    parser.add_argument("--split", action="store_true",
+                        help="write every panel as its own PNG, rendered in a process pool")
+    parser.add_argument("--force", action="store_true",
+                        help="redraw even if the output PNGs are newer than the CSV and have the same DPI")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     OUT_DIR.mkdir(exist_ok=True)
 
     rows = read_rows(CSV_FILE)
-    ops = sorted(set(r["op"] for r in rows))
+    ops = sorted(rows["op"].unique())
     print("CSV:", CSV_FILE)
     print("ops:", ops)
 
-    for op in ["time_search_hit", "time_predecessor", "time_cycles_insert_delete"]:
+    speedups = paired_speedups(rows)
+    for op in TIME_OPS:
         if op in ops:
-            print_speedup_table(rows, op)
-
-    if "time_search_hit" in ops:
-        plot_time(rows, "time_search_hit", "time_search_hit.png")
-        plot_speedup_paired(rows, "time_search_hit", "speedup_search_hit_paired.png")
+            print_speedup_table(speedups.get(op, NO_SAMPLES), op)
 
-    if "time_predecessor" in ops:
-        plot_time(rows, "time_predecessor", "time_predecessor.png")
-        plot_speedup_paired(rows, "time_predecessor", "speedup_predecessor_paired.png")
+    # Workers only get the slice of their op, not the whole frame
+    by_op = dict(list(rows.groupby("op", observed=True)))
 
-    if "time_cycles_insert_delete" in ops:
-        plot_time(rows, "time_cycles_insert_delete", "time_cycles_insert_delete.png")
-        plot_speedup_paired(rows, "time_cycles_insert_delete", "speedup_cycles_paired.png")
+    # Fixed grid cells: one row per timed op (time | paired speedup), memory
+    # check in the last row. Panels without data are left out, so --split
+    # keeps any older PNG and the grid switches their cell off.
+    panels = []
+    for row, op in enumerate(TIME_OPS):
+        if op not in ops:
+            continue
+        panels.append((f"{op}.png", (row, 0), plot_time, (by_op[op], op)))
+        if op in speedups:
+            panels.append((SPEEDUP_FILES[op], (row, 1), plot_speedup_paired, (speedups[op], op)))
+    mem = by_op.get("mem_insert_peak")
+    if mem is not None and mem["variant"].isin(["base", "opt"]).any():
+        panels.append((MEM_FILE, (3, 0), plot_mem_insert_peak, (mem,)))
+
+    if args.split:
+        if not args.force:
+            panels = [panel for panel in panels if not is_up_to_date(OUT_DIR / panel[0], CSV_FILE, args.dpi)]
+        if not panels:
+            print("Per-panel plots are up to date (use --force to redraw)")
+            return
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+            futures = [
+                pool.submit(render_panel, OUT_DIR / out_name, plot, plot_args, args.dpi)
+                for out_name, _, plot, plot_args in panels
+            ]
+            for future in futures:
+                future.result()
+        print("Wrote plots to:", OUT_DIR.resolve())
+        return
 
-    if "mem_insert_peak" in ops:
-        plot_mem_insert_peak(rows, "memory_insert_peak.png")
+    if not args.force and is_up_to_date(OUT_DIR / OUT_FILE, CSV_FILE, args.dpi):
+        print(f"{OUT_FILE} is up to date (use --force to redraw)")
+        return
 
-    print("Wrote plots to:", OUT_DIR.resolve())
+    # Figure is kept across main() calls (e.g. under python -i)
+    global _FIG
+    _FIG = _FIG or plt.subplots(4, 2, figsize=(12, 16), constrained_layout=True)
+    fig, axes = _FIG
+    for ax in axes.flat:
+        ax.cla()
+    used = set()
+    for _, cell, plot, plot_args in panels:
+        plot(axes[cell], *plot_args)
+        used.add(cell)
+    for cell in np.ndindex(axes.shape):
+        if cell not in used:
+            axes[cell].axis("off")
+
+    save_png(fig, OUT_DIR / OUT_FILE, args.dpi)
+
+    print("Wrote plots to:", (OUT_DIR / OUT_FILE).resolve())
 
 if __name__ == "__main__":
     main()